@@ -4,32 +4,303 @@ Simple HTTP proxy for HackForums API
 Validates API key and forwards requests to HackForums
 """
 
+import hashlib
+import hmac
 import os
+import queue
+import socket
+import ssl
 import sys
-import requests
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+import urllib3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.util.retry import Retry
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse
 
 # Configuration
 PORT = int(os.getenv("PORT", "8080"))
 HF_API_BASE = "https://hackforums.net/api/v2"
+HF_API_PREFIX = urlparse(HF_API_BASE).path
+# First path segments of the HF v2 API; anything else is rejected without going upstream
+HF_API_ENDPOINTS = frozenset(("/authorize", "/read", "/write"))
 PROXY_API_KEY = os.getenv("PROXY_API_KEY")
+PROXY_API_KEY_BYTES = (PROXY_API_KEY or "").encode()
+# Each open client connection holds a worker, so keep well above the number of
+# sockets the Next.js app keeps open
+MAX_WORKERS = 256
+# Idle keep-alive connections are closed after this many seconds - below the 4 s
+# undici (Node fetch) default so the client never reuses a socket we are closing
+KEEPALIVE_TIMEOUT = 2
+KEEPALIVE_HEADER = f"Keep-Alive: timeout={KEEPALIVE_TIMEOUT}\r\n".encode("latin-1")
+REQUEST_TIMEOUT = 30
+DEBUG = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
+LOG_QUEUE_SIZE = 10000
+
+# Short-lived cache for repeated GETs of the same resource by the same caller
+CACHE_TTL = 5
+CACHE_MAX_ENTRIES = 4096
+CACHE_MAX_BODY = 1024 * 1024
+# Total bytes held per cache, keeping the worst case well inside a t3.nano's memory
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Longer-lived cache for GETs HF has refused or cannot find, so clients retrying
+# a dead resource do not reach HF each time. 5xx errors are transient and never cached.
+NEGATIVE_CACHE_TTL = 30
+NEGATIVE_CACHE_MAX_ENTRIES = 2048
+NEGATIVE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+NEGATIVE_CACHE_STATUSES = frozenset((403, 404, 410))
+
+class ResumableSSLSocket(ssl.SSLSocket):
+    """SSL socket that hands its session back to its context before closing"""
+
+    def close(self):
+        self.context.remember_session(self)
+        super().close()
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Client SSL context that resumes the most recent TLS session on new sockets
+
+    Reconnects to HF (after an idle timeout or reset) then use an abbreviated
+    handshake instead of a full key exchange and certificate verification.
+    """
+
+    sslsocket_class = ResumableSSLSocket
+    _session = None
+
+    def remember_session(self, sock):
+        """Keep the socket's session if it can be resumed"""
+        # TLS 1.3 tickets only arrive after the handshake, so the session is
+        # captured again when the socket is closed
+        session = sock.session
+        if session is not None and (session.has_ticket or sock.version() != "TLSv1.3"):
+            self._session = session
+
+    def wrap_socket(self, sock, *args, session=None, **kwargs):
+        ssl_sock = super().wrap_socket(sock, *args, session=session or self._session, **kwargs)
+        self.remember_session(ssl_sock)
+        return ssl_sock
+
+SSL_CONTEXT = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+SSL_CONTEXT.minimum_version = ssl.TLSVersion.TLSv1_2
+SSL_CONTEXT.load_default_certs()
+
+# Shared upstream connection pool - keeps TCP/TLS connections to HF alive between
+# requests. Requests are issued straight on the pool with a path-only target, so
+# there is no per-request URL parsing or request preparation. One idle connection
+# per worker can be kept, and a GET that lands on a keep-alive connection HF has
+# already closed is retried once on a fresh one. Only connection-level failures
+# are retried - 429/503 and their Retry-After are relayed to the client as-is.
+POOL = urllib3.connection_from_url(
+    HF_API_BASE,
+    maxsize=MAX_WORKERS,
+    block=False,
+    retries=Retry(
+        total=1, connect=1, read=1, status=0, redirect=0,
+        respect_retry_after_header=False, raise_on_status=False,
+    ),
+    timeout=30,
+    ssl_context=SSL_CONTEXT,
+)
+
+def _error_frame(status, reason, content_type, body):
+    """Serialize a complete error response (status line, headers and body)
+
+    Errors can leave the request body unread, so they always close the connection.
+    """
+    return (
+        f"HTTP/1.1 {status} {reason}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+    ).encode("latin-1") + body
+
+# Headers sent upstream when the client does not override them
+DEFAULT_UPSTREAM_HEADERS = {
+    "Accept": "*/*",
+    "Accept-Encoding": "gzip, deflate",
+    "Content-Type": "application/json",
+}
+
+# Hop-by-hop headers (RFC 7230 section 6.1) that must not be relayed to the client
+HOP_BY_HOP_HEADERS = frozenset({
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+})
+
+# Error responses are fixed, so they are serialized once up front
+ERROR_400 = _error_frame(400, "Bad Request", "application/json", b'{"error": "Bad Request"}')
+ERROR_401 = _error_frame(401, "Unauthorized", "application/json", b'{"error": "Invalid API key"}')
+ERROR_404 = _error_frame(404, "Not Found", "application/json", b'{"error": "Not Found"}')
+ERROR_405 = _error_frame(405, "Method Not Allowed", "text/plain", b"Method Not Allowed")
+ERROR_411 = _error_frame(411, "Length Required", "application/json", b'{"error": "Length Required"}')
+ERROR_502 = _error_frame(502, "Bad Gateway", "application/json", b'{"error": "Bad Gateway"}')
+
+# Log records are formatted and written by a background thread; when it falls
+# behind, new records are dropped rather than blocking request handling
+LOG_QUEUE = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+
+def _drain_log_queue():
+    """Write queued log records to stdout, flushing once per batch"""
+    while True:
+        records = [LOG_QUEUE.get()]
+        try:
+            while True:
+                records.append(LOG_QUEUE.get_nowait())
+        except queue.Empty:
+            pass
+        # A record that fails to format or write is dropped; the thread must survive
+        for timestamp, format, args in records:
+            try:
+                when = time.strftime("%d/%b/%Y %H:%M:%S", time.localtime(timestamp))
+                sys.stdout.write(f"[{when}] {format % args}\n")
+            except Exception:
+                pass
+        try:
+            sys.stdout.flush()
+        except Exception:
+            pass
+
+class RequestBody:
+    """File-like view over the first `length` bytes of the client request body
+
+    Passed as the upstream body alongside an explicit Content-Length, so it is
+    streamed to HF in blocks rather than read into memory first.
+    """
+
+    def __init__(self, rfile, length):
+        self._rfile = rfile
+        self._remaining = length
+
+    def __len__(self):
+        return self._remaining
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        chunk = self._rfile.read(size) if size else b""
+        self._remaining -= len(chunk)
+        return chunk
+
+class TTLCache:
+    """Thread-safe in-memory cache whose entries expire after a fixed TTL
+
+    Bounded both by entry count and by the total size callers report for entries.
+    """
+
+    def __init__(self, maxsize, ttl, maxbytes):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value, size = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                return None
+            return value
+
+    def set(self, key, value, size):
+        """Store value under key as `size` bytes, evicting expired and then oldest entries"""
+        if size > self.maxbytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (now + self.ttl, value, size)
+            self._bytes += size
+            # All entries share one TTL, so insertion order is expiry order
+            while self._data and next(iter(self._data.values()))[0] <= now:
+                self._bytes -= self._data.popitem(last=False)[1][2]
+            while len(self._data) > self.maxsize or self._bytes > self.maxbytes:
+                self._bytes -= self._data.popitem(last=False)[1][2]
+
+RESPONSE_CACHE = TTLCache(CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_MAX_BYTES)
+NEGATIVE_CACHE = TTLCache(NEGATIVE_CACHE_MAX_ENTRIES, NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_MAX_BYTES)
+
+class ProxyServer(ThreadingHTTPServer):
+    """Threaded HTTP server that dispatches connections to a bounded worker pool"""
+
+    daemon_threads = True
+    request_queue_size = 2048
+
+    def __init__(self, server_address, handler_class):
+        self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="proxy")
+        super().__init__(server_address, handler_class)
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        """Hand the connection to the pool instead of spawning a thread per connection"""
+        self._executor.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=self.block_on_close)
 
 class ProxyHandler(BaseHTTPRequestHandler):
     """HTTP request handler that proxies to HackForums API"""
 
+    # Persistent connections let clients reuse one socket (and worker) for many
+    # requests; idle connections are dropped after KEEPALIVE_TIMEOUT seconds
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # Disable Nagle so small JSON replies are not held back waiting for an ACK
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+    def handle_one_request(self):
+        # Waiting for the next request on a kept-alive socket uses the short idle
+        # timeout; running out of it is a normal close, not a failed request
+        self.connection.settimeout(KEEPALIVE_TIMEOUT)
+        try:
+            self.rfile.peek(1)
+        except TimeoutError:
+            self.close_connection = True
+            return
+        # Once a request has started, allow slow bodies and writes the normal timeout
+        self.connection.settimeout(REQUEST_TIMEOUT)
+        super().handle_one_request()
+
     def log_message(self, format, *args):
-        """Custom logging format"""
-        sys.stdout.write(f"[{self.log_date_time_string()}] {format % args}\n")
+        """Custom logging format - queued for the log writer thread"""
+        try:
+            LOG_QUEUE.put_nowait((time.time(), format, args))
+        except queue.Full:
+            pass
 
     def _validate_api_key(self):
         """Validate the X-API-Key header"""
-        api_key = self.headers.get("X-API-Key", "")
-        if api_key != PROXY_API_KEY:
-            self.send_response(401)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(b'{"error": "Invalid API key"}')
+        # Header values are decoded as latin-1, so this round-trips the raw bytes
+        api_key = self.headers.get("X-API-Key", "").encode("latin-1")
+        if not PROXY_API_KEY_BYTES or not hmac.compare_digest(api_key, PROXY_API_KEY_BYTES):
+            # Rejections are not logged, so a flood of bad keys stays cheap
+            self.wfile.write(ERROR_401)
+            self.close_connection = True
             return False
         return True
 
@@ -38,56 +309,162 @@ class ProxyHandler(BaseHTTPRequestHandler):
         if not self._validate_api_key():
             return
 
-        # Build target URL
-        url = f"{HF_API_BASE}{self.path}"
-        self.log_message(f"Proxying {method} {url}")
+        # Turn away scanner noise and unknown endpoints before touching HF
+        path = self.path.partition("?")[0]
+        end = path.find("/", 1)
+        endpoint = path if end == -1 else path[:end]
+        if endpoint not in HF_API_ENDPOINTS or "/.." in path:
+            self._send_error_frame(ERROR_404, 404)
+            return
 
-        # Build headers - forward from client
-        headers = {}
+        # Build target path on the HF host
+        target = HF_API_PREFIX + self.path
+        if DEBUG:
+            self.log_message("Proxying %s %s", method, target)
 
-        # Forward Content-Type header if present, default to application/json
-        content_type = self.headers.get("Content-Type")
-        if content_type:
-            headers["Content-Type"] = content_type
-        else:
-            headers["Content-Type"] = "application/json"
+        # Build headers - start from the defaults and forward Content-Type and
+        # Authorization from the client in a single pass over its headers, noting
+        # Content-Length on the way
+        headers = DEFAULT_UPSTREAM_HEADERS.copy()
+        auth_header = None
+        content_length = None
+        transfer_encoding = None
+        for name, value in self.headers.items():
+            name = name.lower()
+            if name == "content-type":
+                if value:
+                    headers["Content-Type"] = value
+            elif name == "authorization":
+                if value:
+                    headers["Authorization"] = auth_header = value
+            elif name == "content-length":
+                content_length = value
+            elif name == "transfer-encoding":
+                transfer_encoding = value
 
-        # Forward Authorization header if present
-        auth_header = self.headers.get("Authorization")
-        if auth_header:
-            headers["Authorization"] = auth_header
+        # Only Content-Length framed bodies are supported; a chunked body would be
+        # left unread and parsed as the next request on a kept-alive connection
+        if transfer_encoding is not None:
+            self._send_error_frame(ERROR_411, 411)
+            return
 
-        # Get request body if present
-        content_length = int(self.headers.get("Content-Length", 0))
-        body = self.rfile.read(content_length) if content_length > 0 else None
+        # Stream the request body through if present; bodyless requests skip parsing
+        body = None
+        if content_length and content_length != "0":
+            try:
+                length = int(content_length)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._send_error_frame(ERROR_400, 400)
+                return
+            if length > 0:
+                headers["Content-Length"] = str(length)
+                body = RequestBody(self.rfile, length)
 
-        try:
-            # Make request to HF API
-            if method == "GET":
-                response = requests.get(url, headers=headers, timeout=30)
-            elif method == "POST":
-                response = requests.post(url, headers=headers, data=body, timeout=30)
-            else:
-                self.send_response(405)
-                self.send_header("Content-Type", "text/plain")
-                self.end_headers()
-                self.wfile.write(b"Method Not Allowed")
+        if method not in ("GET", "POST"):
+            self._send_error_frame(ERROR_405, 405)
+            return
+
+        # Serve repeated GETs (and recently failed ones) from cache, keyed per caller
+        cache_key = None
+        if method == "GET" and body is None:
+            auth_digest = hashlib.blake2b(
+                (auth_header or "").encode("latin-1"), digest_size=16
+            ).digest()
+            cache_key = (self.path, auth_digest)
+            cached = RESPONSE_CACHE.get(cache_key) or NEGATIVE_CACHE.get(cache_key)
+            if cached is not None:
+                self._send_cached(cached)
                 return
 
-            # Send response back to client
-            self.send_response(response.status_code)
-            for header, value in response.headers.items():
-                if header.lower() not in ["transfer-encoding", "connection"]:
-                    self.send_header(header, value)
-            self.end_headers()
-            self.wfile.write(response.content)
-
-        except requests.RequestException as e:
-            self.log_message(f"Error proxying request: {e}")
-            self.send_response(502)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(b'{"error": "Bad Gateway"}')
+        try:
+            # Make request to HF API over the pool, leaving the body unread.
+            # Redirects are relayed to the client rather than followed.
+            response = POOL.urlopen(
+                method, target, headers=headers, body=body,
+                redirect=False, preload_content=False,
+            )
+        except urllib3.exceptions.HTTPError as e:
+            self.log_message("Error proxying request: %s", e)
+            self._send_error_frame(ERROR_502, 502)
+            return
+
+        try:
+            # Send response back to client, relaying the raw (still encoded) body
+            # in chunks so it is never buffered in full
+            forwarded = [
+                (header, value)
+                for header, value in response.headers.items()
+                if header.lower() not in HOP_BY_HOP_HEADERS
+            ]
+            # Without a Content-Length the body is delimited by closing the connection
+            if "Content-Length" not in response.headers and response.status not in (204, 304):
+                self.close_connection = True
+            self._send_head(response.status, forwarded)
+
+            # Keep a copy of small cacheable bodies as they are relayed
+            cache = None
+            if cache_key is not None:
+                if response.status == 200:
+                    cache = RESPONSE_CACHE
+                elif response.status in NEGATIVE_CACHE_STATUSES:
+                    cache = NEGATIVE_CACHE
+            chunks = None
+            if cache is not None:
+                cache_control = response.headers.get("Cache-Control", "").lower()
+                if "no-store" not in cache_control and "private" not in cache_control:
+                    chunks = []
+            size = 0
+            for chunk in response.stream(65536, decode_content=False):
+                self.wfile.write(chunk)
+                if chunks is not None:
+                    size += len(chunk)
+                    if size > CACHE_MAX_BODY:
+                        chunks = None
+                    else:
+                        chunks.append(chunk)
+            if chunks is not None:
+                # Length and Date are regenerated on every replay
+                forwarded = [(h, v) for h, v in forwarded if h.lower() not in ("content-length", "date")]
+                size += sum(len(h) + len(v) for h, v in forwarded)
+                cache.set(cache_key, (response.status, forwarded, b"".join(chunks)), size)
+        except BaseException:
+            # A partially read response leaves the connection unusable
+            response.close()
+            raise
+        finally:
+            response.release_conn()
+
+    def _send_head(self, status, headers, body=b""):
+        """Write the status line, headers and an optional small body in one write
+
+        Upstream responses already carry their own Date and Server headers.
+        """
+        self.log_request(status)
+        reason = self.responses.get(status, ("",))[0]
+        head = bytearray(f"{self.protocol_version} {status} {reason}\r\n".encode("latin-1"))
+        for header, value in headers:
+            head += b"%s: %s\r\n" % (header.encode("latin-1"), value.encode("latin-1"))
+        if self.close_connection:
+            head += b"Connection: close\r\n"
+        else:
+            head += KEEPALIVE_HEADER
+        head += b"\r\n"
+        head += body
+        self.wfile.write(head)
+
+    def _send_error_frame(self, frame, status):
+        """Write a pre-serialized error response"""
+        self.log_request(status)
+        self.wfile.write(frame)
+        self.close_connection = True
+
+    def _send_cached(self, cached):
+        """Replay a cached (status, headers, body) response"""
+        status, headers, body = cached
+        headers = headers + [("Date", self.date_time_string()), ("Content-Length", str(len(body)))]
+        self._send_head(status, headers, body)
 
     def do_GET(self):
         """Handle GET requests"""
@@ -104,10 +481,12 @@ def main():
         print("ERROR: Missing required environment variable PROXY_API_KEY")
         sys.exit(1)
 
-    # Start server
-    server = HTTPServer(("0.0.0.0", PORT), ProxyHandler)
+    # Start server - connections are handled on a bounded worker pool so a slow
+    # upstream call does not stall every other client
+    server = ProxyServer(("0.0.0.0", PORT), ProxyHandler)
     print(f"Starting HackForums API proxy on port {PORT}")
-    print(f"Proxy API Key: {PROXY_API_KEY[:8]}...")
+    print(f"Proxy API Key: {PROXY_API_KEY[:8]}...", flush=True)
+    threading.Thread(target=_drain_log_queue, name="log-writer", daemon=True).start()
 
     try:
         server.serve_forever()
@@ -132,7 +132,7 @@ yum update -y
 yum install -y python3 python3-pip
 
 # Install Python dependencies
-pip3 install requests
+pip3 install urllib3
 
 # Install and configure CloudWatch agent
 yum install -y amazon-cloudwatch-agent